@@ -0,0 +1,181 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from pymongo import UpdateOne
+
+# Append-only stream of answer submissions. submit_answer only does a non-blocking
+# queue put, a background thread writes events to rotating JSON-lines files in batches
+# and folds them into per-question stats in Mongo.
+
+ANALYTICS_DIR = os.environ.get('ANALYTICS_DIR', '/logs/answers')
+BATCH_SIZE = int(os.environ.get('ANALYTICS_BATCH_SIZE', 200))
+FLUSH_INTERVAL = float(os.environ.get('ANALYTICS_FLUSH_INTERVAL', 5))
+MAX_FILE_BYTES = int(os.environ.get('ANALYTICS_MAX_FILE_BYTES', 10 * 1024 * 1024))
+MAX_FILES = int(os.environ.get('ANALYTICS_MAX_FILES', 20))
+MAX_QUEUE = 10000
+
+
+def question_id(question):
+    # opentdb questions have no id, so key them by their text
+    return hashlib.sha1(question['question'].encode()).hexdigest()[:16]
+
+
+def choice_index(question, answer):
+    # Answers get shuffled for every game, so answers are counted by their position in
+    # sorted(answers), which is the same every time the question comes up
+    return sorted(question['answers']).index(answer)
+
+
+class AnswerLog:
+    def __init__(self, collection, directory=ANALYTICS_DIR, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, max_file_bytes=MAX_FILE_BYTES, max_files=MAX_FILES):
+        self.collection = collection
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+
+        self.events = queue.Queue(maxsize=MAX_QUEUE)
+        self.dropped = 0
+        self.file = None
+        # question id -> text/options/solution, written once per question instead of per event
+        self.questions = {}
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def describe(self, question):
+        # Called when a question is sent out, so the writer can store its text with the stats
+        self.questions[question_id(question)] = {
+            "text": question['question'],
+            "options": sorted(question['answers']),
+            "solution": choice_index(question, question['solution'])
+        }
+
+    def record(self, room, question, zone, latency, correct):
+        # Called from submit_answer, must never block. zone is the screen box the player
+        # stood in, choice is the answer in that box as its index into sorted(answers).
+        event = {
+            "ts": round(time.time(), 3),
+            "room": room,
+            "q": question_id(question),
+            "zone": zone,
+            "choice": choice_index(question, question['answers'][zone]) if zone is not None else None,
+            "latency": round(latency, 3) if latency is not None else None,
+            "correct": correct
+        }
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    # --- Background writer ---
+
+    def _run(self):
+        reported = 0
+        while True:
+            if self.dropped != reported:
+                logging.warning(f"Answer analytics queue full, dropped {self.dropped - reported} events "
+                                f"({self.dropped} total)")
+                reported = self.dropped
+
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self._write_file(batch)
+                self._aggregate(batch)
+            except Exception as e:
+                logging.error(f"Failed to write answer analytics batch: {e}")
+
+    def _next_batch(self):
+        # Wait for the first event, then keep collecting until the batch is full or the interval is up
+        try:
+            batch = [self.events.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.events.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_file(self, batch):
+        if self.file is None or self.file.tell() >= self.max_file_bytes:
+            if self.file:
+                self.file.close()
+            filename = time.strftime('answers-%Y%m%d-%H%M%S.jsonl')
+            self.file = open(os.path.join(self.directory, filename), 'a')
+            self._remove_old_files()
+
+        self.file.write(''.join(json.dumps(event, separators=(',', ':')) + '\n' for event in batch))
+        self.file.flush()
+
+    def _remove_old_files(self):
+        # Names sort by creation time, keep the newest max_files
+        files = sorted(glob.glob(os.path.join(self.directory, 'answers-*.jsonl')))
+        for path in files[:-self.max_files]:
+            os.remove(path)
+
+    def _aggregate(self, batch):
+        # Merge the batch locally first so each question gets one update
+        stats = {}
+        for event in batch:
+            s = stats.setdefault(event['q'], {"answers": 0, "correct": 0, "latency_total": 0, "latency_count": 0})
+            s["answers"] += 1
+            s["correct"] += 1 if event['correct'] else 0
+            if event['latency'] is not None:
+                s["latency_total"] += event['latency']
+                s["latency_count"] += 1
+            choice_key = f"choices.{event['choice'] if event['choice'] is not None else 'none'}"
+            s[choice_key] = s.get(choice_key, 0) + 1
+
+        if stats:
+            ops = []
+            for qid, inc in stats.items():
+                update = {"$inc": inc}
+                if qid in self.questions:
+                    update["$setOnInsert"] = self.questions[qid]
+                ops.append(UpdateOne({"question_id": qid}, update, upsert=True))
+            self.collection.bulk_write(ops, ordered=False)
+            # The docs exist now, the descriptions are only needed for the first insert
+            for qid in stats:
+                self.questions.pop(qid, None)
+
+
+def question_stats(collection, limit=50):
+    # Lowest accuracy first, those are the questions worth looking at
+    return list(collection.aggregate([
+        {"$project": {
+            "_id": 0,
+            "question_id": 1,
+            "text": 1,
+            "options": 1,
+            "solution": 1,
+            "answers": 1,
+            "correct": 1,
+            "choices": 1,
+            "accuracy": {"$divide": ["$correct", "$answers"]},
+            "average_latency": {"$cond": [
+                {"$gt": ["$latency_count", 0]},
+                {"$divide": ["$latency_total", "$latency_count"]},
+                None
+            ]}
+        }},
+        {"$sort": {"accuracy": 1}},
+        {"$limit": limit}
+    ]))
@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+import logging
+import os
+from http.cookies import SimpleCookie
+
+import httpx
+import socketio
+import uvicorn
+from asgiref.wsgi import WsgiToAsgi
+
+import database
+import gameplay
+import user_stats
+import server
+
+# Async mode: Socket.IO runs on an asyncio event loop (python-socketio ASGI) with motor for Mongo
+# and httpx for the trivia API, so idle websockets and DB/HTTP waits don't each hold a thread.
+# The Flask pages are still served by server.app, mounted behind the Socket.IO ASGI app, and
+# the game itself is the same gameplay.Game as sync mode; this file only does the I/O.
+# Start with SERVER_MODE=async (see Dockerfile), the default sync mode is server.py.
+
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins="*")
+app = socketio.ASGIApp(sio, other_asgi_app=WsgiToAsgi(server.app))
+
+db = database.get_async_db()
+users_collection = db['users']
+stats_collection = db['user_stats']
+
+http_client = httpx.AsyncClient(timeout=10)
+
+game_state = server.game_state
+
+async def send(effects):
+    # Apply the effects returned by gameplay.Game with the asyncio Socket.IO server
+    for effect in effects:
+        if isinstance(effect, gameplay.Enter):
+            await sio.enter_room(effect.sid, effect.room)
+        elif isinstance(effect, gameplay.Leave):
+            await sio.leave_room(effect.sid, effect.room)
+        else:
+            await sio.emit(effect.event, effect.data, to=effect.to)
+
+async def fetch_trivia_questions(amount=10):
+    response = await http_client.get(gameplay.TRIVIA_URL.format(amount=amount))
+    return gameplay.parse_trivia_questions(response.json())
+
+@sio.on('connect')
+async def handle_connect(sid, environ):
+    cookies = SimpleCookie(environ.get('HTTP_COOKIE', ''))
+    auth_token = cookies['auth_token'].value if 'auth_token' in cookies else None
+    user = None
+
+    if auth_token:
+        token_hash = hashlib.sha256(auth_token.encode()).hexdigest()
+        user = await users_collection.find_one({"auth_token": token_hash}, {"username": 1})
+
+    game_state.connect(sid, user)
+
+@sio.on('request_next_question')
+async def handle_request_next_question(sid, data):
+    await send(game_state.next_question(data['room']))
+
+@sio.on('move')
+async def handle_move(sid, data):
+    await send(game_state.move(sid, data))
+
+@sio.on('player_push')
+async def handle_player_push(sid, data):
+    await send(game_state.push(sid, data))
+
+@sio.on('sync_positions')
+async def handle_sync_positions(sid, data):
+    await send(game_state.sync_positions(sid, data))
+
+@sio.on('submit_answer')
+async def handle_submit_answer(sid, data):
+    await send(game_state.submit_answer(sid, data))
+
+@sio.on('update_score')
+async def handle_update_score(sid, data):
+    await send(game_state.update_score(sid, data))
+
+@sio.on('join_room')
+async def handle_join(sid, data):
+    # Look the avatar up first, the join itself must not span an await
+    username = game_state.player_data.get(sid, {}).get('username', 'Guest')
+    user = await users_collection.find_one({"username": username}, {"profile_picture": 1})
+    profile_picture = user.get('profile_picture', gameplay.DEFAULT_PFP) if user else gameplay.DEFAULT_PFP
+
+    await send(game_state.join(sid, data.get('room'), profile_picture))
+
+@sio.on('player_ready')
+async def handle_player_ready(sid, data):
+    room = data['room']
+    if game_state.ready(sid, room):
+        # ready() already closed the room to new players, start_game re-checks it still exists
+        questions = None
+        if game_state.needs_questions(room):
+            try:
+                questions = await fetch_trivia_questions()
+            except Exception as e:
+                logging.error(f"Failed to fetch trivia questions for room {room}: {e}")
+            if not questions:
+                game_state.abort_start(room)
+                return
+        await send(game_state.start_game(room, questions))
+
+@sio.on('game_result')
+async def handle_game_result(sid, data):
+    player = game_state.player_data.get(sid, {})
+    if not player.get('user_id'):
+        return
+
+    correct, score, did_win, updates = gameplay.result_updates(data)
+    # Both writes are independent, let them overlap
+    await asyncio.gather(
+        users_collection.update_one({"_id": player['user_id']}, updates),
+        user_stats.record_result_async(stats_collection, player['username'], correct, score, did_win)
+    )
+
+@sio.on('disconnect')
+async def on_disconnect(sid, *args):
+    await send(game_state.disconnect(sid))
+
+if __name__ == '__main__':
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 8080)))
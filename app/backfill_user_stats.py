@@ -0,0 +1,12 @@
+import database
+import user_stats
+
+# One-off migration: copy the stats counters from the users collection into user_stats
+# for players who haven't finished a game since it was added. Safe to run more than once.
+#   docker compose exec web python backfill_user_stats.py
+
+if __name__ == '__main__':
+    db = database.get_db()
+    user_stats.ensure_indexes(db['user_stats'])
+    user_stats.backfill(db['user_stats'], db['users'])
+    print("user_stats backfill done")
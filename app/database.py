@@ -1,9 +1,17 @@
 from pymongo import MongoClient
 import os
 
-def get_db():
+def get_mongo_url():
     mongo_host = os.environ.get('MONGO_HOST', 'mongo')
     mongo_port = int(os.environ.get('MONGO_PORT', 27017))
-    client = MongoClient(f'mongodb://{mongo_host}:{mongo_port}/')
+    return f'mongodb://{mongo_host}:{mongo_port}/'
+
+def get_db():
+    client = MongoClient(get_mongo_url())
     return client['testdb']
 
+def get_async_db():
+    # Used by async_server.py, motor is only needed in async mode
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(get_mongo_url())
+    return client['testdb']
@@ -0,0 +1,410 @@
+import logging
+import random
+import time
+from collections import namedtuple
+
+import matchmaking
+
+# Game logic shared by server.py (threaded) and async_server.py (asyncio). Nothing in here
+# does I/O: every handler updates the in-memory state and returns a list of effects, and
+# each server sends them with its own Socket.IO object. DB/HTTP lookups happen in the
+# servers before calling in, so no state is touched across an await.
+
+Emit = namedtuple('Emit', ['event', 'data', 'to'])
+Enter = namedtuple('Enter', ['sid', 'room'])
+Leave = namedtuple('Leave', ['sid', 'room'])
+
+DEFAULT_PFP = '/static/default-pfp.jpg'
+
+# https://opentdb.com/api.php?amount=${amount}&category=18&difficulty=medium&type=multiple
+TRIVIA_URL = "https://opentdb.com/api.php?amount={amount}&category=18&difficulty=medium&type=multiple"
+
+
+def parse_trivia_questions(data):
+    questions = []
+
+    for result in data['results']:
+        question = result['question']
+        correct = result['correct_answer']
+        incorrect = result['incorrect_answers']
+        all_answers = incorrect + [correct]
+
+        # Randomize answers
+        random.shuffle(all_answers)
+
+        questions.append({
+            'question': question,
+            'answers': all_answers,
+            'solution': correct
+        })
+    return questions
+
+
+def zone_rect(index, canvas_width, canvas_height):
+    # Box of answer number `index` (same order as frontend)
+    rect_width = canvas_width * 0.4
+    rect_height = canvas_height * 0.4
+
+    if index == 0:
+        return (0, 0, rect_width, rect_height)
+    elif index == 1:
+        return (canvas_width - rect_width, 0, rect_width, rect_height)
+    elif index == 2:
+        return (0, canvas_height - rect_height, rect_width, rect_height)
+    elif index == 3:
+        return (canvas_width - rect_width, canvas_height - rect_height, rect_width, rect_height)
+    return None  # Shouldn't happen
+
+
+def answer_zone(question, canvas_width, canvas_height):
+    return zone_rect(question['answers'].index(question['solution']), canvas_width, canvas_height)
+
+
+def answer_at(x, y, canvas_width, canvas_height):
+    # Which answer box the player is standing in, None if outside all of them.
+    # Use the same canvas size the room's correct_zone was built with.
+    for index in range(4):
+        zone_x, zone_y, zone_w, zone_h = zone_rect(index, canvas_width, canvas_height)
+        if zone_x <= x <= zone_x + zone_w and zone_y <= y <= zone_y + zone_h:
+            return index
+    return None
+
+
+def result_updates(data):
+    # Parse a game_result payload into (correct, score, did_win, users doc update)
+    correct = int(data.get('correctAnswers', 0))
+    score = int(data.get('score', 0))
+    did_win = bool(data.get('didWin', False))
+    updates = {
+        "$inc": {
+            "answers_correct": correct,
+            "games_won": 1 if did_win else 0
+        },
+        "$max": {
+            "max_score": score
+        }
+    }
+    return correct, score, did_win, updates
+
+
+class Game:
+    def __init__(self, answer_log=None, matchmaker=None):
+        self.answer_log = answer_log
+        self.matchmaker = matchmaker or matchmaking.Matchmaker()
+
+        # room -> {'players': {sid: {...}}, 'questions': [...], 'correct_zone': ..., ...}
+        self.lobbies = {}
+        # sid -> {'username', 'user_id', 'room', 'x', 'y', 'profile_image'}
+        self.player_data = {}
+
+    # --- Helpers ---
+
+    def _player(self, sid):
+        return self.player_data.setdefault(sid, {"username": "Guest"})
+
+    def _positions(self, room=None):
+        broadcast_players = {}
+        for sid, pdata in self.player_data.items():
+            if room is None or pdata.get('room') == room:
+                broadcast_players[sid] = {
+                    'x': pdata.get('x', 0),
+                    'y': pdata.get('y', 0),
+                    'name': pdata.get('username', 'Guest'),
+                    'profile_picture': pdata.get('profile_image', DEFAULT_PFP)
+                }
+        return broadcast_players
+
+    def _scores(self, room):
+        return [
+            {'username': player['username'], 'score': player.get('score', 0)}
+            for player in self.lobbies[room]['players'].values()
+        ]
+
+    def _start_question(self, room, question, canvas_width, canvas_height):
+        self.lobbies[room]['correct_zone'] = answer_zone(question, canvas_width, canvas_height)
+        self.lobbies[room]['canvas'] = (canvas_width, canvas_height)
+        self.lobbies[room]['question'] = question
+        self.lobbies[room]['question_started'] = time.monotonic()
+        if self.answer_log:
+            self.answer_log.describe(question)
+
+    def _game_over(self, room):
+        players = self.lobbies.get(room, {}).get('players', {})
+        if not players:
+            return []
+
+        winner_sid = max(players, key=lambda sid: players[sid].get('score', 0))
+        winner = players[winner_sid]
+        return [Emit('game_over', {
+            'winnerName': winner['username'],
+            'winnerScore': winner.get('score', 0)
+        }, room)]
+
+    def _leave_lobby(self, sid, room):
+        if room in self.lobbies and sid in self.lobbies[room]['players']:
+            self.lobbies[room]['players'].pop(sid)
+            if self.lobbies[room]['players']:
+                return [Emit('update_lobby', dict(self.lobbies[room]['players']), room)]
+            del self.lobbies[room]
+        return []
+
+    def _move_players(self, sids, old_room, new_room):
+        # Used when an under-filled room gets merged into another waiting room
+        if new_room not in self.lobbies:
+            self.lobbies[new_room] = {'players': {}, 'questions': []}
+
+        effects = []
+        for sid in sids:
+            player = self.lobbies.get(old_room, {}).get('players', {}).pop(sid, None)
+            if player:
+                self.lobbies[new_room]['players'][sid] = player
+            if sid in self.player_data:
+                self.player_data[sid]['room'] = new_room
+
+            effects += [
+                Leave(sid, old_room),
+                Enter(sid, new_room),
+                Emit('room_assigned', {'room': new_room}, sid)
+            ]
+
+        self.lobbies.pop(old_room, None)
+        logging.info(f"[WS] merged room {old_room} into {new_room} ({len(sids)} players)")
+        effects.append(Emit('update_lobby', dict(self.lobbies[new_room]['players']), new_room))
+        return effects
+
+    # --- Events ---
+
+    def connect(self, sid, user):
+        # user is the users doc found from the auth token cookie, or None for guests
+        username = user['username'] if user else "Guest"
+        self.player_data[sid] = {"username": username, "user_id": user['_id'] if user else None}
+        print(f"{username} connected with ID {sid}")
+
+    def join(self, sid, requested, profile_picture):
+        # Socket may have disconnected while the caller was looking up the avatar
+        if sid not in self.player_data:
+            return []
+
+        player = self.player_data[sid]
+        effects = []
+
+        # Leave whatever room this connection was in before
+        previous = player.get('room')
+        if previous:
+            effects.append(Leave(sid, previous))
+            effects += self._leave_lobby(sid, previous)
+
+        room = self.matchmaker.join(sid, requested)
+        effects.append(Enter(sid, room))
+
+        # Requested room was full or already playing, tell the client where it ended up
+        if room != requested:
+            effects.append(Emit('room_assigned', {'room': room}, sid))
+
+        if room not in self.lobbies:
+            self.lobbies[room] = {'players': {}, 'questions': []}
+
+        username = player.get('username', 'Guest')
+        logging.info(f"[WS] {username} joined room {room} (sid={sid})")
+
+        player['room'] = room
+        player['profile_image'] = profile_picture
+
+        self.lobbies[room]['players'][sid] = {
+            'username': username,
+            'ready': False,
+            'profile_picture': profile_picture
+        }
+
+        effects.append(Emit('update_lobby', dict(self.lobbies[room]['players']), room))
+        return effects
+
+    def ready(self, sid, room):
+        # Returns True when this player tipped the room over the ready threshold. The room
+        # stops taking new players right away, the caller then fetches questions (if
+        # needs_questions) and calls start_game.
+        lobby = self.lobbies.get(room)
+        if not lobby or sid not in lobby['players'] or lobby.get('starting'):
+            return False
+
+        lobby['players'][sid]['ready'] = True
+
+        players = lobby['players']
+        ready_players = sum(1 for p in players.values() if p['ready'])
+        if ready_players / len(players) < 0.5:
+            return False
+
+        lobby['starting'] = True
+        self.matchmaker.start(room)
+        return True
+
+    def abort_start(self, room):
+        # Fetching questions failed, open the room again so pressing ready retries
+        lobby = self.lobbies.get(room)
+        if lobby:
+            lobby['starting'] = False
+        self.matchmaker.unstart(room)
+
+    def needs_questions(self, room):
+        return not self.lobbies.get(room, {}).get('questions')
+
+    def start_game(self, room, questions=None):
+        # The room may have emptied out while questions were being fetched
+        if room not in self.lobbies:
+            return []
+
+        if questions and not self.lobbies[room]['questions']:
+            self.lobbies[room]['questions'] = questions
+
+        effects = [Emit('start_game', {}, room)]  # only tell clients "game starting"
+        return effects + self.next_question(room)
+
+    def next_question(self, room):
+        questions = self.lobbies.get(room, {}).get('questions', [])
+
+        if questions:
+            question = questions.pop(0)
+
+            # Before sending the question, save the correct answer's box
+            self._start_question(room, question, 1920 - 275, 1080)
+            return [Emit('next_question', question, room)]
+
+        print(f"No more questions left in room {room}. Game Over!")
+        return self._game_over(room)
+
+    def move(self, sid, data):
+        user = self._player(sid)
+
+        # ✅ Update the player's own server position
+        user['x'] = data['x']
+        user['y'] = data['y']
+
+        username = user.get('username', 'Guest')
+        logging.info(f"[WS] {username} moved: {data}")
+
+        data.update({
+            'name': username,
+            'profile_picture': user.get('profile_image', DEFAULT_PFP),
+            'id': sid
+        })
+        room = user.get('room')
+        if room:
+            return [Emit('player_moved', data, room)]
+        return []
+
+    def push(self, sid, data):
+        room = data['room']
+        push_x = data['x']
+        push_y = data['y']
+
+        push_radius = 150  # How far the push can reach
+        push_strength = 50  # How much to move the players away
+
+        if not room or room not in self.lobbies:
+            return []
+
+        # Move players away if they are close enough
+        for other_sid in self.lobbies[room]['players']:
+            if other_sid == sid:
+                continue  # Don't push yourself
+
+            other_pos = self.player_data.get(other_sid, {})
+            ox = other_pos.get('x')
+            oy = other_pos.get('y')
+
+            if ox is None or oy is None:
+                continue
+
+            dx = ox - push_x
+            dy = oy - push_y
+            distance = (dx ** 2 + dy ** 2) ** 0.5
+
+            if distance < push_radius and distance != 0:
+                factor = (push_radius - distance) / push_radius
+                self.player_data[other_sid]['x'] = ox + (dx / distance) * push_strength * factor
+                self.player_data[other_sid]['y'] = oy + (dy / distance) * push_strength * factor
+
+        # Broadcast updated player positions after the push
+        return [Emit('update_positions', self._positions(room), room)]
+
+    def sync_positions(self, sid, data):
+        for other_sid, player_info in data['players'].items():
+            if other_sid in self.player_data:
+                self.player_data[other_sid]['x'] = player_info['x']
+                self.player_data[other_sid]['y'] = player_info['y']
+
+        return [Emit('update_positions', self._positions(data['room']), data['room'])]
+
+    def submit_answer(self, sid, data):
+        room = self.player_data.get(sid, {}).get('room')
+        x = data['x']
+        y = data['y']
+
+        if not room or room not in self.lobbies:
+            return []
+
+        lobby = self.lobbies[room]
+        correct_zone = lobby.get('correct_zone')
+        if not correct_zone or sid not in lobby['players']:
+            return []
+
+        zone_x, zone_y, zone_w, zone_h = correct_zone
+        players = lobby['players']
+
+        # Update player score if they are correct
+        correct = zone_x <= x <= zone_x + zone_w and zone_y <= y <= zone_y + zone_h
+        if correct:
+            players[sid]['score'] = players[sid].get('score', 0) + 200
+
+        # Queued for the background writer, doesn't touch disk or Mongo here
+        if self.answer_log:
+            started = lobby.get('question_started')
+            self.answer_log.record(room, lobby['question'], answer_at(x, y, *lobby['canvas']),
+                                   time.monotonic() - started if started else None, correct)
+
+        # Mark that this player answered
+        players[sid]['answered'] = True
+
+        effects = []
+        if all(player.get('answered') for player in players.values()):
+            # Reset "answered" for next round
+            for player in players.values():
+                player['answered'] = False
+
+            if lobby['questions']:
+                question = lobby['questions'].pop(0)
+
+                # BEFORE emitting next question, set correct_zone
+                self._start_question(room, question, 1024, 576)  # match your frontend!
+                effects.append(Emit('next_question', question, room))
+            else:
+                effects += self._game_over(room)
+
+        effects.append(Emit('update_player_scores', self._scores(room), room))
+        return effects
+
+    def update_score(self, sid, data):
+        room = self.player_data.get(sid, {}).get('room')
+
+        if room and sid in self.lobbies.get(room, {}).get('players', {}):
+            self.lobbies[room]['players'][sid]['score'] = data.get('score', 0)
+
+            # After updating, broadcast new scores
+            player_scores = sorted(self._scores(room), key=lambda p: p['score'], reverse=True)
+            return [Emit('update_player_scores', player_scores, room)]
+        return []
+
+    def disconnect(self, sid):
+        room = self.player_data.get(sid, {}).get('room')
+        effects = []
+
+        if room:
+            effects += self._leave_lobby(sid, room)
+
+        # Merge the room into another one if it is left under-filled
+        old_room, target, moved = self.matchmaker.leave(sid)
+        if target:
+            effects += self._move_players(moved, old_room, target)
+
+        self.player_data.pop(sid, None)
+        return effects
@@ -0,0 +1,168 @@
+import os
+import secrets
+import threading
+import time
+
+# Max players per room, and the size below which a waiting room gets merged into another one
+ROOM_CAPACITY = int(os.environ.get('ROOM_CAPACITY', 8))
+MERGE_THRESHOLD = int(os.environ.get('ROOM_MERGE_THRESHOLD', 2))
+
+# How long a room handed out by the lobby is kept around with nobody in it yet
+RESERVATION_TTL = int(os.environ.get('ROOM_RESERVATION_TTL', 30))
+
+# Room state only lives in this process's memory, so this only works with a single web
+# process. Running more than one would need the room table moved into shared storage.
+
+
+class Matchmaker:
+    def __init__(self, capacity=ROOM_CAPACITY, merge_threshold=MERGE_THRESHOLD,
+                 reservation_ttl=RESERVATION_TTL):
+        self.capacity = capacity
+        self.merge_threshold = merge_threshold
+        self.reservation_ttl = reservation_ttl
+
+        # room -> {'players': set of sids, 'started': bool, 'auto': bool, 'created': float}
+        # auto is True for rooms the matchmaker made up, rooms named with ?room= are never matched or merged
+        self.rooms = {}
+        # sid -> room
+        self.player_rooms = {}
+        self.lock = threading.Lock()
+
+    # --- Helpers (call with lock held) ---
+
+    def _new_room(self, room=None):
+        auto = room is None
+        if auto:
+            room = secrets.token_hex(3)
+            while room in self.rooms:
+                room = secrets.token_hex(3)
+
+        self.rooms[room] = {
+            'players': set(),
+            'started': False,
+            'auto': auto,
+            'created': time.monotonic()
+        }
+        return room
+
+    def _prune(self):
+        # Drop rooms that were handed out but nobody joined in time
+        now = time.monotonic()
+        expired = [
+            room for room, info in self.rooms.items()
+            if not info['players'] and now - info['created'] > self.reservation_ttl
+        ]
+        for room in expired:
+            del self.rooms[room]
+
+    def _open_rooms(self, exclude=None, auto_only=False):
+        return [
+            room for room, info in self.rooms.items()
+            if room != exclude and not info['started'] and len(info['players']) < self.capacity
+            and (info['auto'] or not auto_only)
+        ]
+
+    def _pick_room(self):
+        # Fill the fullest waiting room first so games start sooner and rooms stay packed
+        self._prune()
+        open_rooms = self._open_rooms(auto_only=True)
+        if not open_rooms:
+            return self._new_room()
+        return max(open_rooms, key=lambda r: len(self.rooms[r]['players']))
+
+    def _remove(self, sid):
+        room = self.player_rooms.pop(sid, None)
+        if room in self.rooms:
+            info = self.rooms[room]
+            info['players'].discard(sid)
+            if not info['players']:
+                if info['auto']:
+                    # Keep it for a bit so a refresh lands back in the same matched room
+                    info['created'] = time.monotonic()
+                else:
+                    del self.rooms[room]
+        return room
+
+    # --- Public API ---
+
+    def assign(self):
+        # Room for a player coming from the lobby without a room picked
+        with self.lock:
+            return self._pick_room()
+
+    def join(self, sid, requested=None):
+        # Returns the room the player actually ended up in. The requested room is
+        # honored unless it is full or already playing, then the player gets matched.
+        with self.lock:
+            self._remove(sid)
+
+            if requested and requested not in self.rooms:
+                room = self._new_room(requested)
+            elif requested and requested in self._open_rooms():
+                room = requested
+            else:
+                room = self._pick_room()
+
+            self.rooms[room]['players'].add(sid)
+            self.player_rooms[sid] = room
+            return room
+
+    def leave(self, sid):
+        # Returns (room, target, moved_sids). If the room the player left is now
+        # under-filled and still waiting, its players get moved into another waiting room.
+        with self.lock:
+            room = self._remove(sid)
+            if room not in self.rooms:
+                return room, None, []
+
+            info = self.rooms[room]
+            if not info['auto'] or info['started'] or not info['players'] \
+                    or len(info['players']) >= self.merge_threshold:
+                return room, None, []
+
+            candidates = [
+                r for r in self._open_rooms(exclude=room, auto_only=True)
+                if len(self.rooms[r]['players']) + len(info['players']) <= self.capacity
+            ]
+            if not candidates:
+                return room, None, []
+
+            target = max(candidates, key=lambda r: len(self.rooms[r]['players']))
+            moved = list(info['players'])
+            for moved_sid in moved:
+                self.rooms[target]['players'].add(moved_sid)
+                self.player_rooms[moved_sid] = target
+            del self.rooms[room]
+            return room, target, moved
+
+    def start(self, room):
+        # Rooms that are playing stop taking new players
+        with self.lock:
+            if room in self.rooms:
+                self.rooms[room]['started'] = True
+
+    def unstart(self, room):
+        with self.lock:
+            if room in self.rooms:
+                self.rooms[room]['started'] = False
+
+    def occupancy(self):
+        # Private rooms are only counted, listing their names would let anyone join them
+        with self.lock:
+            self._prune()
+            rooms = [
+                {
+                    'room': room,
+                    'players': len(info['players']),
+                    'capacity': self.capacity,
+                    'started': info['started']
+                }
+                for room, info in self.rooms.items() if info['auto']
+            ]
+            private = [info for info in self.rooms.values() if not info['auto']]
+            return {
+                'rooms': rooms,
+                'private_rooms': len(private),
+                'private_players': sum(len(info['players']) for info in private),
+                'total_players': len(self.player_rooms)
+            }
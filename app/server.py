@@ -1,5 +1,5 @@
 from flask import Flask, flash, jsonify, make_response, redirect, render_template, request, url_for, send_from_directory
-from flask_socketio import SocketIO, emit, join_room, leave_room
+from flask_socketio import SocketIO, join_room, leave_room
 
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField
@@ -7,8 +7,10 @@ from wtforms.validators import InputRequired, Length, EqualTo, Regexp
 
 
 import requests
-import random
 import database
+import gameplay
+import user_stats
+import answer_analytics
 import logging
 import traceback
 import os
@@ -64,6 +66,14 @@ users_collection = db['users']
 questions_collection = db['questions']
 player_collection = db['players']
 leaderboard_collection = db['leaderboard']
+stats_collection = db['user_stats']
+users_collection.create_index("username")
+users_collection.create_index("auth_token", sparse=True)
+user_stats.ensure_indexes(stats_collection)
+question_stats_collection = db['question_stats']
+question_stats_collection.create_index("question_id", unique=True)
+answer_log = answer_analytics.AnswerLog(question_stats_collection)
+game_state = gameplay.Game(answer_log)
 
 
 # ****Protects against CSRF attacks (CHANGE LATER)****
@@ -115,9 +125,18 @@ def home():
 def lobby():
     return render_template('lobby.html')
 
+@app.route('/lobby/match')
+def lobby_match():
+    # Hand out a room with space left instead of piling everyone into one room
+    return jsonify({"room": game_state.matchmaker.assign()})
+
+@app.route('/lobby/rooms')
+def lobby_rooms():
+    return jsonify(game_state.matchmaker.occupancy())
+
 @app.route('/game')
 def game():
-    room = request.args.get('room', 'default')
+    room = request.args.get('room') or game_state.matchmaker.assign()
     return render_template('game.html', room=room)
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -183,22 +202,21 @@ def getInfo():
     print(data, flush=True)
     return jsonify(data)
 
+@app.route('/analytics/questions')
+def analytics_questions():
+    return jsonify({
+        "questions": answer_analytics.question_stats(question_stats_collection),
+        "dropped_events": answer_log.dropped
+    })
+
 @app.route('/stats')
 def stats():
-    auth_token = request.cookies.get('auth_token')
-    username = "Guest"
-    stats = {"answers_correct": 0, "games_won": 0, "max_score": 0}
+    # User was already looked up by attach_username, only the stats doc is read here
+    username = request.username
+    stats = dict(user_stats.DEFAULT_STATS)
 
-    if auth_token:
-        token_hash = hashlib.sha256(auth_token.encode()).hexdigest()
-        user = users_collection.find_one({"auth_token": token_hash})
-        if user:
-            username = user['username']
-            stats = {
-                "answers_correct": user.get("answers_correct", 0),
-                "games_won": user.get("games_won", 0),
-                "max_score": user.get("max_score", 0)
-            }
+    if request.user:
+        stats = user_stats.get_stats(stats_collection, username)
 
     return render_template("stats.html", username=username, stats=stats)
 
@@ -232,62 +250,31 @@ def register():
 
     return render_template('register.html', form=form)
 
-@socketio.on('request_next_question')
-def handle_request_next_question(data):
-    room = data['room']
-    questions = lobbies.get(room, {}).get('questions', [])
-
-    if questions:
-        next_question = questions.pop(0)
-
-        # Before sending the question, save the correct answer's box
-        correct_index = next_question['answers'].index(next_question['solution'])
-
-        # Find the correct box (same order as frontend)
-        canvas_width = 1920 - 275  # Match your frontend Canvas width
-        canvas_height = 1080
-
-        rect_width = canvas_width * 0.4
-        rect_height = canvas_height * 0.4
-
-        if correct_index == 0:
-            correct_zone = (0, 0, rect_width, rect_height)
-        elif correct_index == 1:
-            correct_zone = (canvas_width - rect_width, 0, rect_width, rect_height)
-        elif correct_index == 2:
-            correct_zone = (0, canvas_height - rect_height, rect_width, rect_height)
-        elif correct_index == 3:
-            correct_zone = (canvas_width - rect_width, canvas_height - rect_height, rect_width, rect_height)
+def send(effects):
+    # Apply the effects returned by gameplay.Game with Flask-SocketIO
+    for effect in effects:
+        if isinstance(effect, gameplay.Enter):
+            join_room(effect.room, sid=effect.sid, namespace='/')
+        elif isinstance(effect, gameplay.Leave):
+            leave_room(effect.room, sid=effect.sid, namespace='/')
         else:
-            correct_zone = None  # Shouldn't happen
-
-        # 🚀 Save correct zone on server
-        lobbies[room]['correct_zone'] = correct_zone
-
-        socketio.emit('next_question', next_question, room=room)
-
-    else:
-        print(f"No more questions left in room {room}. Game Over!")
-
-        players = lobbies.get(room, {}).get('players', {})
-        if players:
-            winner_sid = max(players, key=lambda sid: players[sid].get('score', 0))
-            winner = players[winner_sid]
+            socketio.emit(effect.event, effect.data, to=effect.to)
 
-            socketio.emit('game_over', {
-                'winnerName': winner['username'],
-                'winnerScore': winner.get('score', 0)
-            }, room=room)
+@socketio.on('request_next_question')
+def handle_request_next_question(data):
+    send(game_state.next_question(data['room']))
 
 @app.before_request
 def attach_username():
    request.username = "Guest"
+   request.user = None
    auth_token = request.cookies.get('auth_token')
    if auth_token:
        token_hash = hashlib.sha256(auth_token.encode()).hexdigest()
        user = users_collection.find_one({"auth_token": token_hash})
        if user:
            request.username = user['username']
+           request.user = user
 
 @app.after_request
 def log_all_requests(response):
@@ -333,218 +320,36 @@ def log_all_requests(response):
 
    return response
 
-player_data = {}
-
 @socketio.on('move')
 def handle_move(data):
-    sid = request.sid
-    user = player_data.get(sid, {})
-
-    # ✅ Update the player's own server position
-    user['x'] = data['x']
-    user['y'] = data['y']
-
-    # Update player_data dictionary
-    player_data[sid] = user
-
-    username = user.get('username', 'Guest')
-    logging.info(f"[WS] {username} moved: {data}")
-
-    data.update({
-        'name': user.get('username', 'Guest'),
-        'profile_picture': user.get('profile_image', '/static/default-pfp.jpg'),
-        'id': sid
-    })
-    room = user.get('room')
-    if room:
-        emit('player_moved', data, room=room)
+    send(game_state.move(request.sid, data))
 
 @socketio.on('player_push')
 def handle_player_push(data):
-    room = data['room']
-    sid = request.sid
-
-    push_x = data['x']
-    push_y = data['y']
-
-    push_radius = 150  # How far the push can reach
-    push_strength = 50  # How much to move the players away
-
-    if not room or room not in lobbies:
-        return
-
-    # Move players away if they are close enough
-    for other_sid, pdata in lobbies[room]['players'].items():
-        if other_sid == sid:
-            continue  # Don't push yourself
-
-        other_pos = player_data.get(other_sid, {})
-        ox = other_pos.get('x')
-        oy = other_pos.get('y')
-
-        if ox is None or oy is None:
-            continue
-
-        dx = ox - push_x
-        dy = oy - push_y
-        distance = (dx ** 2 + dy ** 2) ** 0.5
-
-        if distance < push_radius and distance != 0:
-            # Calculate push
-            factor = (push_radius - distance) / push_radius
-            move_x = (dx / distance) * push_strength * factor
-            move_y = (dy / distance) * push_strength * factor
-
-            # Update server position
-            player_data[other_sid]['x'] = ox + move_x
-            player_data[other_sid]['y'] = oy + move_y
-
-    # Broadcast updated player positions after the push
-    broadcast_players = {}
-    for sid, pdata in player_data.items():
-        if pdata.get('room') == room:
-            broadcast_players[sid] = {
-                'x': pdata.get('x', 0),
-                'y': pdata.get('y', 0),
-                'name': pdata.get('username', 'Guest'),
-                'profile_picture': pdata.get('profile_image', '/static/default-pfp.jpg')
-            }
-
-    socketio.emit('update_positions', broadcast_players, room=room)
+    send(game_state.push(request.sid, data))
 
 @socketio.on('sync_positions')
 def handle_sync_positions(data):
-    room = data['room']
-    updated_players = data['players']
-
-    # Update player_data with the new positions
-    for sid, player_info in updated_players.items():
-        if sid in player_data:
-            player_data[sid]['x'] = player_info['x']
-            player_data[sid]['y'] = player_info['y']
-
-    # Create a clean payload to send back
-    broadcast_players = {}
-    for sid, pdata in player_data.items():
-        broadcast_players[sid] = {
-            'x': pdata.get('x', 0),
-            'y': pdata.get('y', 0),
-            'name': pdata.get('username', 'Guest'),
-            'profile_picture': pdata.get('profile_image', '/static/default-pfp.jpg')
-        }
-
-
-    socketio.emit('update_positions', broadcast_players, room=room)
+    send(game_state.sync_positions(request.sid, data))
 
 @socketio.on('connect')
 def handle_connect():
     auth_token = request.cookies.get('auth_token')
-    username = "Guest"
+    user = None
 
     if auth_token:
         token_hash = hashlib.sha256(auth_token.encode()).hexdigest()
-        user = users_collection.find_one({"auth_token": token_hash})
-        if user:
-            username = user['username']
+        user = users_collection.find_one({"auth_token": token_hash}, {"username": 1})
 
-    player_data[request.sid] = {"username": username}
-    print(f"{username} connected with ID {request.sid}")
+    game_state.connect(request.sid, user)
 
 @socketio.on('submit_answer')
 def handle_submit_answer(data):
-    sid = request.sid
-    room = player_data.get(sid, {}).get('room')
-    x = data['x']
-    y = data['y']
-
-    if not room or room not in lobbies:
-        return
-
-    correct_zone = lobbies[room].get('correct_zone')
-    if not correct_zone:
-        return
-
-    zone_x, zone_y, zone_w, zone_h = correct_zone
-
-    # Update player score if they are correct
-    if zone_x <= x <= zone_x + zone_w and zone_y <= y <= zone_y + zone_h:
-        lobbies[room]['players'][sid]['score'] = lobbies[room]['players'][sid].get('score', 0) + 200
-
-    # Mark that this player answered
-    lobbies[room]['players'][sid]['answered'] = True
-
-    # Check if ALL players have answered
-    all_answered = all(player.get('answered') for player in lobbies[room]['players'].values())
-
-    if all_answered:
-        # Reset "answered" for next round
-        for player in lobbies[room]['players'].values():
-            player['answered'] = False
-
-        # Move to next question
-        if lobbies[room]['questions']:
-            next_question = lobbies[room]['questions'].pop(0)
-
-            # BEFORE emitting next question, set correct_zone
-            correct_index = next_question['answers'].index(next_question['solution'])
-
-            canvas_width = 1024  # match your frontend!
-            canvas_height = 576
-
-            rect_width = canvas_width * 0.4
-            rect_height = canvas_height * 0.4
-
-            if correct_index == 0:
-                correct_zone = (0, 0, rect_width, rect_height)
-            elif correct_index == 1:
-                correct_zone = (canvas_width - rect_width, 0, rect_width, rect_height)
-            elif correct_index == 2:
-                correct_zone = (0, canvas_height - rect_height, rect_width, rect_height)
-            elif correct_index == 3:
-                correct_zone = (canvas_width - rect_width, canvas_height - rect_height, rect_width, rect_height)
-
-            lobbies[room]['correct_zone'] = correct_zone
-
-            socketio.emit('next_question', next_question, room=room)
-
-        else:
-            # No more questions, game over
-            players = lobbies.get(room, {}).get('players', {})
-            winner_sid = max(players, key=lambda sid: players[sid].get('score', 0))
-            winner = players[winner_sid]
-
-            socketio.emit('game_over', {
-                'winnerName': winner['username'],
-                'winnerScore': winner.get('score', 0)
-            }, room=room)
-
-    # Update player scores
-    player_scores = [
-        {'username': player['username'], 'score': player.get('score', 0)}
-        for player in lobbies[room]['players'].values()
-    ]
-    socketio.emit('update_player_scores', player_scores, room=room)
+    send(game_state.submit_answer(request.sid, data))
 
 @socketio.on('update_score')
 def handle_update_score(data):
-    sid = request.sid
-    room = player_data.get(sid, {}).get('room')
-    score = data.get('score', 0)
-
-    if room and sid in lobbies.get(room, {}).get('players', {}):
-        lobbies[room]['players'][sid]['score'] = score
-
-        # After updating, broadcast new scores
-        player_scores = sorted(
-            [
-                {'username': player['username'], 'score': player.get('score', 0)}
-                for player in lobbies[room]['players'].values()
-            ],
-            key=lambda p: p['score'],
-            reverse=True
-        )
-
-        socketio.emit('update_player_scores', player_scores, room=room)
+    send(game_state.update_score(request.sid, data))
 
 # --- Set up avatar uploads
 
@@ -554,14 +359,15 @@ app.config['UPLOAD_DIR'] = UPLOAD_DIR
 
 @app.route('/profile')
 def profile():
-    username = request.cookies.get("username")
-    user = users_collection.find_one({"username": username})
+    # Use the auth token lookup from attach_username instead of the username cookie
+    user = request.user
     if not user:
         return redirect(url_for("home"))
-    
+
     profile_pic = user.get("profile_picture", "/static/default-pfp.jpg")
+    stats = user_stats.get_stats(stats_collection, user['username'])
 
-    return render_template("profile.html", user_pfp=profile_pic)
+    return render_template("profile.html", user_pfp=profile_pic, stats=stats)
 
 def allowed_file(filename):
     ALLOWED_EXTENSIONS = {"jpg", "png", "jpeg"}
@@ -569,6 +375,11 @@ def allowed_file(filename):
 
 @app.route("/profile/upload", methods=["POST"])
 def upload_profile_pic():
+    # Same auth token lookup as /profile, the username cookie can be set by anyone
+    user = request.user
+    if not user:
+        return jsonify({'status': 'error', 'message': 'Not logged in'}), 401
+
     file = request.files["file"]
 
     if file.filename == "":
@@ -582,131 +393,60 @@ def upload_profile_pic():
         file.save(filepath)
 
         # Update user profile picture in the database
-        username = request.cookies.get("username")
-        if username:
-            users_collection.update_one(
-                {"username": username},
-                {"$set": {"profile_picture": f"/static/uploads/{filename}"}}
-            )
-
-            return jsonify({
-                'status': 'ok',
-                'message': 'Profile picture updated successfully!',
-                'profile_picture': f"/static/uploads/{filename}"
-            }), 200
+        users_collection.update_one(
+            {"_id": user['_id']},
+            {"$set": {"profile_picture": f"/static/uploads/{filename}"}}
+        )
+
+        return jsonify({
+            'status': 'ok',
+            'message': 'Profile picture updated successfully!',
+            'profile_picture': f"/static/uploads/{filename}"
+        }), 200
 
     return jsonify({'status': 'error', 'message': 'Invalid upload'}), 400
 
 # Lobby
-lobbies = {}
-
-# https://opentdb.com/api.php?amount=${amount}&category=18&difficulty=medium&type=multiple
 def fetch_trivia_questions(amount=10):
-    response = requests.get(f"https://opentdb.com/api.php?amount={amount}&category=18&difficulty=medium&type=multiple")
-    data = response.json()
-    questions = []
-
-    for result in data['results']:
-        question = result['question']
-        correct = result['correct_answer']
-        incorrect = result['incorrect_answers']
-        all_answers = incorrect + [correct]
-
-        # Randomize answers
-        random.shuffle(all_answers)
-
-        questions.append({
-            'question': question,
-            'answers': all_answers,
-            'solution': correct
-        })
-    return questions
+    response = requests.get(gameplay.TRIVIA_URL.format(amount=amount))
+    return gameplay.parse_trivia_questions(response.json())
 
 @socketio.on('join_room')
 def handle_join(data):
-    room = data['room']
-    join_room(room)
-
-    if room not in lobbies:
-        lobbies[room] = {'players': {}, 'questions': []}
-
-    sid = request.sid
-    username = player_data.get(sid, {}).get('username', 'Guest')
-    lobbies[room]['players'][request.sid] = {'username': username, 'ready': False}
-    logging.info(f"[WS] {username} joined room {room} (sid={sid})")
-
-    username = player_data.get(request.sid, {}).get('username', 'Guest')
-    user = users_collection.find_one({"username": username})
-    profile_picture = user.get('profile_picture', '/static/default-pfp.jpg') if user else '/static/default-pfp.jpg'
-
-    player_data[request.sid]['room'] = room
-    player_data[request.sid]['profile_image'] = profile_picture
-
-    lobbies[room]['players'][request.sid] = {
-        'username': username,
-        'ready': False,
-        'profile_picture': profile_picture
-    }
-
-    emit('update_lobby', lobbies[room]['players'], room=room)
+    username = game_state.player_data.get(request.sid, {}).get('username', 'Guest')
+    user = users_collection.find_one({"username": username}, {"profile_picture": 1})
+    profile_picture = user.get('profile_picture', gameplay.DEFAULT_PFP) if user else gameplay.DEFAULT_PFP
 
+    send(game_state.join(request.sid, data.get('room'), profile_picture))
 
 @socketio.on('player_ready')
 def handle_player_ready(data):
     room = data['room']
-    lobbies[room]['players'][request.sid]['ready'] = True
-
-    players = lobbies[room]['players']
-    total_players = len(players)
-    ready_players = sum(1 for p in players.values() if p['ready'])
-
-    if ready_players / total_players >= 0.5:
-        if not lobbies[room]['questions']:
-            lobbies[room]['questions'] = fetch_trivia_questions()
-        socketio.emit('start_game', {}, room=room)  # only tell clients "game starting"
-
-        handle_request_next_question({'room': room})
+    if game_state.ready(request.sid, room):
+        questions = None
+        if game_state.needs_questions(room):
+            try:
+                questions = fetch_trivia_questions()
+            except Exception as e:
+                logging.error(f"Failed to fetch trivia questions for room {room}: {e}")
+            if not questions:
+                game_state.abort_start(room)
+                return
+        send(game_state.start_game(room, questions))
 
 @socketio.on('game_result')
 def handle_game_result(data):
-    auth_token = request.cookies.get('auth_token')
-    if not auth_token:
-        return
-    token_hash = hashlib.sha256(auth_token.encode()).hexdigest()
-    user = users_collection.find_one({"auth_token": token_hash})
-    if not user:
+    player = game_state.player_data.get(request.sid, {})
+    if not player.get('user_id'):
         return
-    # Extract stats
-    correct = int(data.get('correctAnswers', 0))
-    score = int(data.get('score', 0))
-    did_win = bool(data.get('didWin', False))
-    updates = {
-        "$inc": {
-            "answers_correct": correct,
-            "games_won": 1 if did_win else 0
-        },
-        "$max": {
-            "max_score": score
-        }
-    }
-    users_collection.update_one({"_id": user['_id']}, updates)
+
+    correct, score, did_win, updates = gameplay.result_updates(data)
+    users_collection.update_one({"_id": player['user_id']}, updates)
+    user_stats.record_result(stats_collection, player['username'], correct, score, did_win)
 
 @socketio.on('disconnect')
 def on_disconnect():
-    sid = request.sid
-    room = player_data.get(sid, {}).get('room')
-
-    if room and room in lobbies and sid in lobbies[room]['players']:
-        del lobbies[room]['players'][sid]
-
-        # Optional: broadcast updated lobby
-        emit('update_lobby', lobbies[room]['players'], room=room)
-
-        # Clean up empty rooms
-        if not lobbies[room]['players']:
-            del lobbies[room]
-
-    player_data.pop(sid, None)
+    send(game_state.disconnect(request.sid))
 
 @app.errorhandler(Exception)
 def handle_exception(e):
@@ -34,6 +34,12 @@ socket.on("connect", () => {
     socket.emit("join_room", { room: ROOM_ID });
 });
 
+// Server put us in a different room (requested one was full, or ours got merged)
+socket.on('room_assigned', function(data) {
+    ROOM_ID = data.room;
+    history.replaceState(null, '', `/game?room=${encodeURIComponent(ROOM_ID)}`);
+});
+
 socket.on('player_moved', function(data) {
     players[data.id] = {
         x: data.x,
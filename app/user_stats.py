@@ -0,0 +1,111 @@
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+# Per-user stats document, kept up to date whenever a game result comes in so the
+# stats/profile pages read one doc by username instead of recomputing anything.
+# The rank is not stored, it is counted on read (see get_stats).
+
+DEFAULT_STATS = {
+    "games_played": 0,
+    "games_won": 0,
+    "tracked_wins": 0,
+    "answers_correct": 0,
+    "total_score": 0,
+    "max_score": 0,
+    "win_rate": 0,
+    "average_score": 0,
+    "rank": None
+}
+
+# Ordering used for the global rank (also the index the rank count runs on)
+RANK_ORDER = [("games_won", DESCENDING), ("max_score", DESCENDING)]
+
+
+def ensure_indexes(collection):
+    collection.create_index([("username", ASCENDING)], unique=True)
+    collection.create_index(RANK_ORDER)
+
+
+def backfill(collection, users_collection, batch_size=1000):
+    # One-off copy of the stats that used to live on the users doc (run backfill_user_stats.py).
+    # Games played and total score were never tracked there, so they start at 0 and win rate /
+    # average score only cover games played from here on. $setOnInsert leaves existing docs alone.
+    ops = []
+    for user in users_collection.find({}, {"username": 1, "answers_correct": 1, "games_won": 1, "max_score": 1}):
+        ops.append(UpdateOne({"username": user["username"]}, {"$setOnInsert": {
+            "username": user["username"],
+            "games_played": 0,
+            "games_won": user.get("games_won", 0),
+            "tracked_wins": 0,
+            "answers_correct": user.get("answers_correct", 0),
+            "total_score": 0,
+            "max_score": user.get("max_score", 0),
+            "win_rate": 0,
+            "average_score": 0
+        }}, upsert=True))
+        if len(ops) >= batch_size:
+            collection.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        collection.bulk_write(ops, ordered=False)
+
+
+def _add(field, amount):
+    return {"$add": [{"$ifNull": [f"${field}", 0]}, amount]}
+
+
+def _result_pipeline(username, correct, score, did_win):
+    # Bump the counters, then recompute the derived fields from them
+    return [
+        {"$set": {
+            "username": username,
+            "games_played": _add("games_played", 1),
+            "games_won": _add("games_won", 1 if did_win else 0),
+            # Wins out of games_played, games_won can include backfilled wins from before games were counted
+            "tracked_wins": _add("tracked_wins", 1 if did_win else 0),
+            "answers_correct": _add("answers_correct", correct),
+            "total_score": _add("total_score", score),
+            "max_score": {"$max": [{"$ifNull": ["$max_score", 0]}, score]}
+        }},
+        {"$set": {
+            "win_rate": {"$divide": ["$tracked_wins", "$games_played"]},
+            "average_score": {"$divide": ["$total_score", "$games_played"]}
+        }}
+    ]
+
+
+def _ahead_filter(doc):
+    # Rank = number of players strictly ahead in RANK_ORDER + 1, counted off the rank index
+    return {
+        "$or": [
+            {"games_won": {"$gt": doc["games_won"]}},
+            {"games_won": doc["games_won"], "max_score": {"$gt": doc["max_score"]}}
+        ]
+    }
+
+
+def record_result(collection, username, correct, score, did_win):
+    collection.update_one(
+        {"username": username},
+        _result_pipeline(username, correct, score, did_win),
+        upsert=True
+    )
+
+
+async def record_result_async(collection, username, correct, score, did_win):
+    # Same as record_result, for a motor collection
+    await collection.update_one(
+        {"username": username},
+        _result_pipeline(username, correct, score, did_win),
+        upsert=True
+    )
+
+
+def get_stats(collection, username):
+    stats = dict(DEFAULT_STATS)
+    doc = collection.find_one({"username": username}, {"_id": 0, "username": 0})
+    if doc:
+        stats.update(doc)
+        # Counted on read so it stays right as other players move past. This is one count on
+        # the RANK_ORDER index per page view, and it walks one index key per player ahead.
+        stats["rank"] = collection.count_documents(_ahead_filter(doc)) + 1
+    return stats